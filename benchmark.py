@@ -0,0 +1,473 @@
+import argparse
+import contextlib
+import copy
+import datetime
+import json
+import logging
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from OpenSSL import crypto
+from werkzeug.serving import make_server
+
+# blockchain.py opens its log file at import time, so the directory has to exist first
+os.makedirs('logs', exist_ok=True)
+
+import blockchain
+from app import app
+from verifier import HttpVerifier, LocalVerifier
+from scheduler import PrimaryScheduler
+from history import ReputationHistory
+
+PERCENTILES = (50, 90, 95, 99)
+
+def generate_nodes(count, authority_ratio, follower_ratio):
+    """
+    Generates a synthetic node registry in the format of 'nodes_init.json'.
+
+    Args:
+        count (int): The total number of nodes to generate
+        authority_ratio (float): The fraction of nodes that are authority nodes [0-1]
+        follower_ratio (float): The fraction of the remaining nodes that are full follower nodes [0-1]
+
+    Returns:
+        dict: A dictionary mapping the node index to the node data
+    """
+    # The consensus functions need at least two authorities and one follower to form votes
+    authority_count = max(2, int(count * authority_ratio))
+    nodes = {}
+    for node_id in range(max(count, authority_count + 1)):
+        is_authority = node_id < authority_count
+        is_full_node = is_authority or random.random() < follower_ratio or node_id == authority_count
+        if is_authority:
+            reputation = random.randrange(blockchain.AUTHORITY_THRESHOLD, 3 * blockchain.AUTHORITY_THRESHOLD, 50)
+        else:
+            reputation = random.randrange(0, blockchain.AUTHORITY_THRESHOLD, 50)
+        nodes[node_id] = {
+            "is_authority": is_authority,
+            "is_full_node": is_full_node,
+            "reputation": reputation,
+            "certificate": "cert",
+            "device_id": random.randrange(1, 10 ** 6),
+            "promote_count": 1 if is_authority else 0
+        }
+    return nodes
+
+def generate_payload(device_id):
+    """
+    Generates a synthetic state payload in the format of 'states/payload_1.json'.
+
+    Args:
+        device_id (int): The ID of the device broadcasting the state
+
+    Returns:
+        dict: The state payload
+    """
+    return {
+        "deviceId": str(device_id),
+        "timestamp": datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'),
+        "currentState": {
+            "temperature": round(random.uniform(-10, 40), 1),
+            "humidity": round(random.uniform(0, 100), 1),
+            "pressure": round(random.uniform(950, 1050), 1),
+            "status": random.choice(["ON", "OFF"])
+        }
+    }
+
+def _create_certificate(common_name, key, issuer_cert=None, issuer_key=None, is_ca=False, not_before=0, not_after=365 * 24 * 3600):
+    """
+    Creates an X509 certificate signed by the issuer, or self-signed if no issuer is given.
+
+    Args:
+        common_name (str): The common name of the subject
+        key (crypto.PKey): The key pair of the subject
+        issuer_cert (crypto.X509): The certificate of the issuer
+        issuer_key (crypto.PKey): The key pair of the issuer
+        is_ca (bool): Whether the certificate may sign other certificates
+        not_before (int): Offset in seconds from now at which the certificate becomes valid
+        not_after (int): Offset in seconds from now at which the certificate expires
+
+    Returns:
+        crypto.X509: The signed certificate
+    """
+    cert = crypto.X509()
+    cert.set_version(2)
+    cert.set_serial_number(random.getrandbits(64))
+    cert.get_subject().CN = common_name
+    cert.gmtime_adj_notBefore(not_before)
+    cert.gmtime_adj_notAfter(not_after)
+    cert.set_pubkey(key)
+    cert.set_issuer((issuer_cert or cert).get_subject())
+    cert.add_extensions([
+        crypto.X509Extension(b"basicConstraints", True, b"CA:TRUE" if is_ca else b"CA:FALSE")
+    ])
+    cert.sign(issuer_key or key, "sha256")
+    return cert
+
+def generate_certificates():
+    """
+    Generates a synthetic chain of trust (root and intermediate CA) with a valid and an expired device certificate.
+
+    Returns:
+        dict: The PEM-encoded CA chain, valid device certificate and expired device certificate
+    """
+    def new_key():
+        key = crypto.PKey()
+        key.generate_key(crypto.TYPE_RSA, 2048)
+        return key
+
+    root_key, intermediate_key, device_key = new_key(), new_key(), new_key()
+    root_cert = _create_certificate("bench-root", root_key, is_ca=True)
+    intermediate_cert = _create_certificate("bench-intermediate", intermediate_key, root_cert, root_key, is_ca=True)
+    valid_cert = _create_certificate("bench-device", device_key, intermediate_cert, intermediate_key)
+    expired_cert = _create_certificate("bench-device", device_key, intermediate_cert, intermediate_key, not_before=-2 * 24 * 3600, not_after=-24 * 3600)
+
+    def dump(cert):
+        return crypto.dump_certificate(crypto.FILETYPE_PEM, cert).decode()
+
+    return {
+        "chain": dump(intermediate_cert) + dump(root_cert),
+        "valid": dump(valid_cert),
+        "expired": dump(expired_cert)
+    }
+
+def start_ca_server(ca_chain):
+    """
+    Starts a local stand-in for the Vault PKI endpoint that serves the CA chain.
+
+    Args:
+        ca_chain (str): The PEM-encoded CA chain to serve
+
+    Returns:
+        ThreadingHTTPServer: The running server
+    """
+    body = ca_chain.encode()
+
+    class CAChainHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # Headers and body are separate writes, which Nagle's algorithm would delay on a kept-alive connection
+        disable_nagle_algorithm = True
+
+        def do_GET(self):
+            if self.path != "/v1/pki/ca_chain":
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "application/pem-certificate-chain")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), CAChainHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def start_verify_server():
+    """
+    Starts the Flask verification app from 'app.py' on a free local port.
+
+    Returns:
+        BaseWSGIServer: The running server
+    """
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def summarize(latencies):
+    """
+    Computes the throughput and latency percentiles of a benchmark run.
+
+    Args:
+        latencies (list): The latency of every operation in seconds
+
+    Returns:
+        dict: The number of operations, ops/sec and latency statistics in milliseconds
+    """
+    ordered = sorted(latencies)
+    total = sum(ordered)
+    latency_ms = {
+        "min": ordered[0] * 1000,
+        "mean": total / len(ordered) * 1000,
+        "max": ordered[-1] * 1000
+    }
+    for percentile in PERCENTILES:
+        # Nearest-rank percentile
+        rank = max(1, math.ceil(percentile / 100 * len(ordered)))
+        latency_ms[f"p{percentile}"] = ordered[rank - 1] * 1000
+    return {
+        "ops": len(ordered),
+        "ops_per_sec": len(ordered) / total if total else None,
+        "latency_ms": {name: round(value, 4) for name, value in latency_ms.items()}
+    }
+
+def measure(operation, iterations, warmup, setup=None):
+    """
+    Runs an operation repeatedly and records the latency of every call.
+
+    Args:
+        operation (function): The operation to benchmark, called with the value returned by setup
+        iterations (int): The number of timed calls
+        warmup (int): The number of untimed calls made first
+        setup (function): An optional function called before every call whose cost is not timed
+
+    Returns:
+        dict: The summary of the run
+    """
+    latencies = []
+    for i in range(warmup + iterations):
+        state = setup(i) if setup else i
+        start = time.perf_counter()
+        operation(state)
+        elapsed = time.perf_counter() - start
+        if i >= warmup:
+            latencies.append(elapsed)
+    return summarize(latencies)
+
+def bench_verify(certificates, iterations, warmup):
+    """
+    Benchmarks a certificate verification including the retrieval of the CA chain.
+
+    Args:
+        certificates (dict): The synthetic certificates
+        iterations (int): The number of timed calls
+        warmup (int): The number of untimed calls made first
+
+    Returns:
+        dict: The summary of the run
+    """
+    def operation(i):
+        cert = certificates["valid"] if i % 2 == 0 else certificates["expired"]
+        vote = blockchain.verifier.verify(cert, blockchain.verifier.get_ca_chain())
+        if vote != (cert == certificates["valid"]):
+            raise RuntimeError(f"Unexpected verification result {vote}")
+    return measure(operation, iterations, warmup)
+
+def bench_add(nodes, certificates, iterations, warmup):
+    """
+    Benchmarks the registration of a device with a valid certificate, as done by '--method add'.
+
+    Args:
+        nodes (dict): The synthetic node registry
+        certificates (dict): The synthetic certificates
+        iterations (int): The number of timed calls
+        warmup (int): The number of untimed calls made first
+
+    Returns:
+        dict: The summary of the run
+    """
+    authority_nodes = blockchain.get_authority_indices(nodes)
+
+    def setup(i):
+        return copy.deepcopy(nodes), i % len(authority_nodes)
+
+    def operation(state):
+        registry, primary_index = state
+        blockchain.authority_verify(primary_index, certificates["valid"])
+        blockchain.Node().add_node(registry, 0, True, certificates["valid"], random.randrange(1, 10 ** 6), primary_index)
+    return measure(operation, iterations, warmup, setup)
+
+def bench_broadcast(nodes, workdir, noise, iterations, warmup):
+    """
+    Benchmarks a state broadcast, as done by '--method broadcast', including choosing the primary
+    and recording the changes in the history and the scheduler.
+
+    Args:
+        nodes (dict): The synthetic node registry
+        workdir (str): The path to store the chain, history and scheduler files in
+        noise (float): The network noise ratio [0-1]
+        iterations (int): The number of timed calls
+        warmup (int): The number of untimed calls made first
+
+    Returns:
+        dict: The summary of the run
+    """
+    chain_file = os.path.join(workdir, 'broadcast_chain.json')
+    history_file = os.path.join(workdir, 'broadcast_history.json')
+    scheduler_file = os.path.join(workdir, 'broadcast_scheduler.json')
+    for path in (chain_file, history_file, scheduler_file):
+        if os.path.exists(path):
+            os.remove(path)
+    chain = blockchain.Blockchain(chain_file)
+    history = ReputationHistory(history_file)
+    history.reset(nodes, 0)
+    blockchain.scheduler = PrimaryScheduler(scheduler_file, blockchain.PRIMARY_COOLDOWN)
+
+    def setup(i):
+        # Every broadcast starts from the synthetic registry so that the authority nodes stay the same
+        registry = copy.deepcopy(nodes)
+        return registry, blockchain.get_authority_indices(registry), generate_payload(random.randrange(1, 10 ** 6))
+
+    def operation(state):
+        registry, authority_nodes, payload = state
+        blockchain.broadcast_state(registry, authority_nodes, chain, payload, noise)
+        blockchain.record_changes(history, registry, chain_file)
+    return measure(operation, iterations, warmup, setup)
+
+def bench_schedule(nodes, state_file, iterations, warmup):
+    """
+    Benchmarks choosing the primary authority node, including persisting the scheduler state.
+
+    Args:
+        nodes (dict): The synthetic node registry
+        state_file (str): The path to the file storing the scheduler state
+        iterations (int): The number of timed calls
+        warmup (int): The number of untimed calls made first
+
+    Returns:
+        dict: The summary of the run
+    """
+    if os.path.exists(state_file):
+        os.remove(state_file)
+    scheduler = PrimaryScheduler(state_file, blockchain.PRIMARY_COOLDOWN)
+    authority_nodes = blockchain.get_authority_indices(nodes)
+    return measure(lambda i: blockchain.get_primary(scheduler, nodes, authority_nodes), iterations, warmup)
+
+def write_chain(chain_file, length):
+    """
+    Writes a synthetic chain of the given length to a file.
+
+    Args:
+        chain_file (str): The path to the chain file
+        length (int): The number of blocks after the genesis block
+    """
+    blocks = [blockchain.Block(0, str(datetime.datetime.now()), "Genesis Block", '').display_block()]
+    for index in range(1, length + 1):
+        block = blockchain.Block(index, str(datetime.datetime.now()), generate_payload(index), blocks[-1]['hash'])
+        blocks.append(block.display_block())
+    with open(chain_file, 'w') as f:
+        json.dump(blocks, f)
+
+def bench_chain_load(chain_file, iterations, warmup):
+    """
+    Benchmarks loading a chain from disk.
+
+    Args:
+        chain_file (str): The path to a pre-populated chain file
+        iterations (int): The number of timed calls
+        warmup (int): The number of untimed calls made first
+
+    Returns:
+        dict: The summary of the run
+    """
+    return measure(lambda i: blockchain.Blockchain(chain_file), iterations, warmup)
+
+def bench_chain_append(chain_file, iterations, warmup):
+    """
+    Benchmarks appending a block to a chain loaded from disk. The chain grows by one block per call.
+
+    Args:
+        chain_file (str): The path to a pre-populated chain file
+        iterations (int): The number of timed calls
+        warmup (int): The number of untimed calls made first
+
+    Returns:
+        dict: The summary of the run
+    """
+    chain = blockchain.Blockchain(chain_file)
+    return measure(chain.add_block, iterations, warmup, lambda i: generate_payload(i))
+
+def git_revision():
+    """
+    Returns:
+        str: The commit hash of the working tree, or None if it cannot be determined
+    """
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)), stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+BENCHMARKS = ['verify', 'add', 'broadcast', 'chain_load', 'chain_append', 'schedule']
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='This benchmarks registration, broadcast and verification throughput of the Proof of Verified Authority Consensus')
+
+    parser.add_argument('--bench', type=str, nargs='+', choices=BENCHMARKS, help='This argument selects the benchmarks to run', default=BENCHMARKS)
+    parser.add_argument('--nodes', type=int, help='This argument specifies the number of synthetic nodes', default=100)
+    parser.add_argument('--authority_ratio', type=float, help='This argument specifies the fraction of authority nodes [0-1]', default=0.3)
+    parser.add_argument('--follower_ratio', type=float, help='This argument specifies the fraction of other nodes that are full nodes [0-1]', default=0.8)
+    parser.add_argument('--chain_length', type=int, help='This argument specifies the number of blocks in the synthetic chain', default=1000)
+    parser.add_argument('--iterations', type=int, help='This argument specifies the number of timed operations per benchmark', default=50)
+    parser.add_argument('--warmup', type=int, help='This argument specifies the number of untimed operations per benchmark', default=5)
+    parser.add_argument('--verifier', type=str, choices=['http', 'local'], help='This argument selects the certificate verification backend', default='http')
+    parser.add_argument('--max_noise', type=float, help='This argument takes the network noise for broadcast [value between 0-1]', default=0.3)
+    parser.add_argument('--seed', type=int, help='This argument seeds the random generator for reproducible runs', default=0)
+    parser.add_argument('--workdir', type=str, help='This argument takes in the path to store the synthetic files', default=None)
+    parser.add_argument('--output', type=str, help='This argument takes in the path to store the results as JSON', default=None)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    # Consensus logging would dominate the measured latencies
+    blockchain.logger.setLevel(logging.ERROR)
+    workdir = args.workdir or tempfile.mkdtemp(prefix='pova_bench_')
+    os.makedirs(workdir, exist_ok=True)
+
+    nodes = generate_nodes(args.nodes, args.authority_ratio, args.follower_ratio)
+    with open(os.path.join(workdir, 'nodes_{}.json'.format(args.nodes)), 'w') as f:
+        json.dump(nodes, f)
+    certificates = generate_certificates()
+    for name, pem in certificates.items():
+        with open(os.path.join(workdir, '{}.pem'.format(name)), 'w') as f:
+            f.write(pem)
+
+    servers = []
+    if args.verifier == 'local':
+        blockchain.verifier = LocalVerifier(os.path.join(workdir, 'chain.pem'))
+    else:
+        servers = [start_ca_server(certificates["chain"]), start_verify_server()]
+        blockchain.verifier = HttpVerifier(
+            "http://127.0.0.1:{}/v1/pki/ca_chain".format(servers[0].server_port),
+            "http://127.0.0.1:{}/verify-certificate".format(servers[1].server_port),
+            timeout=blockchain.REQUEST_TIMEOUT)
+
+    results = {}
+    # The verifier prints the reason of every rejected certificate, which must not end up in the report on stdout
+    with contextlib.redirect_stdout(sys.stderr):
+        try:
+            for bench in args.bench:
+                if bench == 'verify':
+                    results[bench] = bench_verify(certificates, args.iterations, args.warmup)
+                elif bench == 'add':
+                    results[bench] = bench_add(nodes, certificates, args.iterations, args.warmup)
+                elif bench == 'broadcast':
+                    results[bench] = bench_broadcast(nodes, workdir, args.max_noise, args.iterations, args.warmup)
+                elif bench == 'schedule':
+                    results[bench] = bench_schedule(nodes, os.path.join(workdir, 'scheduler.json'), args.iterations, args.warmup)
+                elif bench == 'chain_load':
+                    chain_file = os.path.join(workdir, 'chain_{}.json'.format(args.chain_length))
+                    write_chain(chain_file, args.chain_length)
+                    results[bench] = bench_chain_load(chain_file, args.iterations, args.warmup)
+                elif bench == 'chain_append':
+                    chain_file = os.path.join(workdir, 'chain_{}.json'.format(args.chain_length))
+                    write_chain(chain_file, args.chain_length)
+                    results[bench] = bench_chain_append(chain_file, args.iterations, args.warmup)
+        finally:
+            for server in servers:
+                server.shutdown()
+
+    report = {
+        "meta": {
+            "revision": git_revision(),
+            "timestamp": str(datetime.datetime.now()),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "workdir": workdir,
+            "parameters": {key: value for key, value in vars(args).items() if key not in ('output', 'workdir')}
+        },
+        "results": results
+    }
+    report_json = json.dumps(report, indent=4, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(report_json + "\n")
+    print(report_json)
@@ -1,16 +1,18 @@
 import hashlib
 import json
 import time
-import requests
 import argparse
 import logging
 import datetime
-import os
 import random
 from collections import Counter
+from bisect import bisect_left
 import ast
 
 from Colour import ColourLogs
+from verifier import HttpVerifier, LocalVerifier
+from history import ReputationHistory
+from scheduler import PrimaryScheduler
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
@@ -145,6 +147,21 @@ class Blockchain:
     def display_chain(self):
         return self.chain
 
+def get_chain_height(chain_file):
+    """
+    This function returns the index of the last block of the chain stored in a file.
+    Args:
+        chain_file (str): The path to the file storing the blockchain data
+
+    Returns:
+        int: The index of the last block, 0 if the chain is empty
+    """
+    try:
+        with open(chain_file, 'r') as f:
+            return json.load(f)[-1]['index']
+    except (FileNotFoundError, json.JSONDecodeError, IndexError):
+        return 0
+
 
 nodes = {}
 authority_nodes = {}
@@ -157,8 +174,12 @@ BLOCK_REWARD = 100          # The reward given to every node if their vote was i
 PRIMARY_REWARD = 250        # The reward given to the primary authority
 PENALTY = 450               # Penalty for no voting in case of authority nodes
 MAX_TRANSACTION_RATIO = 3   # Maximum limit of promotions
+PRIMARY_COOLDOWN = 2        # The number of rounds an authority node is not chosen as primary after it failed to vote
 VERIFY_URL = "http://127.0.0.1:5000/verify-certificate"
 CA_CHAIN_URL = "http://127.0.0.1:8200/v1/pki/ca_chain"
+REQUEST_TIMEOUT = 5         # Seconds to wait for the CA or the verification server before the vote fails
+verifier = HttpVerifier(CA_CHAIN_URL, VERIFY_URL, timeout=REQUEST_TIMEOUT)   # The backend used by the nodes to verify certificates
+scheduler = None            # The scheduler choosing the primary authority node, set when run from the command line
 
 class Node:
     def __init__(self):
@@ -210,20 +231,19 @@ class Node:
 
         # These lists store the indices if they voted
         follower_node_indices = []
-        auth_vote, authority_node_indices = authority_voting(nodes)
+        auth_vote, authority_node_votes = authority_voting(nodes, certificate)
+        if scheduler is not None:
+            scheduler.mark_failed([node_id for node_id, vote in authority_node_votes.items() if vote == "Fail"])
         
         if auth_vote == None:
             return False
 
         for node_id, node_data in nodes.items():
             if node_data["is_full_node"] and node_data["is_authority"] == False:
-                chain_response = requests.get(CA_CHAIN_URL)
+                ca_chain = verifier.get_ca_chain()
                 logger.info(f"Node {node_id} has retrieved the CA chain")
-                # print(chain_response.text)
-                verify_response = requests.post(VERIFY_URL, data={"certificate": cert_data, "trusted": chain_response.text})
 
-                # Check if the response was successful
-                if str(auth_vote) == verify_response.text:
+                if verifier.verify(certificate, ca_chain) == auth_vote:
                     logger.info(f"Node {node_id} is in consensus with authority nodes")
                     follower_node_indices.append(node_id)
                 else:
@@ -242,7 +262,7 @@ class Node:
         else:
             logger.info("Node cannot be added as majority vote not attained")
 
-        self.penalize_authority(nodes, authority_node_indices)
+        self.penalize_authority(nodes, authority_node_votes)
         self.reward_follower_nodes(nodes, follower_node_indices)
         
         self.update_reputation_by_authority_index(nodes, primary_index)
@@ -312,25 +332,44 @@ class Node:
                 node_data["reputation"] -= PENALTY
                 logger.info(f"Node {node_id} is an Authority node and has been penalized: Reason: No vote in transaction")
         
-def get_primary():
+def get_primary(scheduler, nodes, authority_nodes):
     """
-    This function returns the primary node index in a round robin fashion
+    This function chooses the primary authority node by weighted round robin over the reputation of the authority nodes.
+    Args:
+        scheduler (PrimaryScheduler): The scheduler persisting the rounds
+        nodes (dict): A dictionary containing the data of all nodes added to the network
+        authority_nodes (list): The sorted list of authority nodes
+
     Returns:
-        None
+        int: The index of the primary authority node with respect to the list of authority nodes
     """
-    if not os.path.exists('index.txt'):
-        return 0
-    with open('index.txt', 'r') as f:
-        return int(f.read().strip())
-    
-def set_primary(index):
+    primary = scheduler.next_primary()
+    position = bisect_left(authority_nodes, primary) if primary is not None else len(authority_nodes)
+    if position == len(authority_nodes) or authority_nodes[position] != primary:
+        # The scheduler has not seen these authority nodes yet, e.g. on the first run or with another nodes file
+        scheduler.sync({node_id: nodes[node_id]['reputation'] for node_id in authority_nodes})
+        primary = scheduler.next_primary()
+        position = bisect_left(authority_nodes, primary)
+    return position
+
+def get_authority_changes(nodes, delta):
     """
-    This function sets the index of the next primary authority node.
+    This function returns the changes of the authority nodes to apply to the primary scheduler.
     Args:
-        index (int): The index of the primary authority node
+        nodes (dict): A dictionary containing the data of all nodes added to the network
+        delta (dict): The changed fields of the nodes as recorded in the history
+
+    Returns:
+        dict: A dictionary mapping the index of every changed node to its reputation, or None if it is not an authority node
     """
-    with open('index.txt', 'w') as f:
-        f.write(str(index))
+    changes = {}
+    for node_id, fields in delta.items():
+        node_id = int(node_id)
+        if fields is None or not nodes[node_id]['is_authority']:
+            changes[node_id] = None
+        elif 'reputation' in fields or 'is_authority' in fields:
+            changes[node_id] = nodes[node_id]['reputation']
+    return changes
 
 def authority_verify(index, cert_data):
     """
@@ -339,14 +378,12 @@ def authority_verify(index, cert_data):
         cert_data (str): The PEM-encoded certificate
 
     Returns:
+        bool or None: The verification result of the primary authority node, None if the verification failed
     """
-    chain_response = requests.get(CA_CHAIN_URL)
+    ca_chain = verifier.get_ca_chain()
     logger.info(f"Authority node {index} is the primary node")
     logger.info(f"Authority node {index} has retrieved the CA chain")
-    # print(chain_response.text)
-    verify_response = requests.post(VERIFY_URL, data={"certificate": cert_data, "trusted": chain_response.text})
-    # logger.info(verify_response.text)
-    return verify_response.text
+    return verifier.verify(cert_data, ca_chain)
 
 def get_authority_indices(nodes):
     """
@@ -355,9 +392,9 @@ def get_authority_indices(nodes):
         nodes (dict): A dictionary containing the data of all nodes added to the network
 
     Returns:
-     list: The list of indices of authority nodes with respect to the nodes dictionary
+     list: The sorted list of indices of authority nodes with respect to the nodes dictionary
     """
-    return [node_id for node_id, node_data in nodes.items() if node_data["is_authority"]]
+    return sorted(node_id for node_id, node_data in nodes.items() if node_data["is_authority"])
 
 
 def penalize_primary(nodes, index, follower_count):
@@ -375,13 +412,14 @@ def penalize_primary(nodes, index, follower_count):
         logger.info("The Authority Node has fell below the threshold and has been removed from the network")
         follower_count -= 1
 
-def authority_voting(nodes):
+def authority_voting(nodes, cert_data):
     """
     This function facilitates the voting of the authority nodes.
     Args:
         nodes(dict): A dictionary containing the data of all nodes added to the network
+        cert_data (str): The PEM-encoded certificate
     Returns:
-        bool or None, list of authority nodes
+        bool or None, dict mapping the authority nodes to their vote ("True", "False" or "Fail")
     """
     authority_node_votes = {}
     votes_true = 0
@@ -390,14 +428,13 @@ def authority_voting(nodes):
     for node_id, node_data in nodes.items():
 
         if node_data["is_authority"]:
-            chain_response = requests.get(CA_CHAIN_URL)
+            ca_chain = verifier.get_ca_chain()
             logger.info(f"Node {node_id} has retrieved the CA chain")
-            # print(chain_response.text)
-            verify_response = requests.post(VERIFY_URL, data={"certificate": cert_data, "trusted": chain_response.text})
+            vote = verifier.verify(cert_data, ca_chain)
 
-            # Check if the response was successful
-            if verify_response.status_code == 200:
-                if verify_response.text == "True":
+            # Check if the verification was successful
+            if vote is not None:
+                if vote:
                     logger.info(f"Node {node_id} has verified the certificate. Response: The certificate is valid")
                     votes_true += 1
                     authority_node_votes[node_id] = "True"
@@ -409,10 +446,10 @@ def authority_voting(nodes):
                 authority_node_votes[node_id] = "Fail"
     # print(authority_node_votes)
     if votes_true == votes_false >= len(authority_node_votes) // 2:
-        return None, []
+        return None, authority_node_votes
     elif votes_true > votes_false or votes_false > votes_true:
-        return votes_true > len(authority_node_votes) // 2, authority_node_votes.keys()
-    return None, []           
+        return votes_true > len(authority_node_votes) // 2, authority_node_votes
+    return None, authority_node_votes           
 
 def remove_primary_entry(votes, primary_index):
     """
@@ -547,25 +584,86 @@ def broadcast_reward(nodes, auth_votes_map, followers_votes_map, auth_vote, auth
             if nodes[node_id]['reputation'] >= AUTHORITY_THRESHOLD and nodes[node_id]['promote_count'] < MAX_TRANSACTION_RATIO:
                 nodes[node_id]['is_authority'] = True
 
+def broadcast_state(nodes, authority_nodes, blockchain, state, noise_flag):
+    """
+    This function runs a consensus round on a state change and adds it to the blockchain if accepted.
+    Args:
+        nodes (dict): A dictionary containing the data of all nodes added to the network
+        authority_nodes (list): The sorted list of authority nodes
+        blockchain (Blockchain): The blockchain to add the state to
+        state (dict): The state broadcasted to be added to the blockchain
+        noise_flag (float): Network noise ratio [0-1]
+
+    Returns:
+        bool: True if the state has been added to the blockchain
+    """
+    primary_index = get_primary(scheduler, nodes, authority_nodes)
+    logger.debug(f"Authority Node {primary_index} has been chosen")
+
+    logger.debug(f"Indices of authority nodes are {authority_nodes}")
+    auth_votes_map, auth_vote, auth_vote_percent = broadcast_authority(authority_nodes, primary_index, noise_flag)
+    scheduler.mark_failed([node_id for node_id, vote in auth_votes_map.items() if vote == False])
+    follower_votes_map, follower_vote, follower_vote_percent = broadcast_followers(nodes, primary_index, authority_nodes, noise_flag)
+
+    broadcast_reward(nodes, auth_votes_map, follower_votes_map, auth_vote, authority_nodes, primary_index)
+    consensus_message = {False: "reject", True:"accept"}
+    logger.info(f"{round(auth_vote_percent, 2)}% are in consensus to {consensus_message[auth_vote]} the state change.")
+
+    if(auth_vote_percent > 50 and auth_vote == True):
+        logger.info("The transaction has been added")
+        blockchain.add_block(state)
+        return True
+    logger.warning("The transaction has not been added as it was not in majority consensus")
+    return False
+
+def record_changes(history, nodes, chain_file):
+    """
+    This function records the changes of the node states in the history and applies them to the primary scheduler.
+    Args:
+        history (ReputationHistory): The history of the node states
+        nodes (dict): A dictionary containing the data of all nodes added to the network
+        chain_file (str): The path to the file storing the blockchain data
+    """
+    try:
+        delta = history.record(get_chain_height(chain_file), nodes)
+        history.save()
+        scheduler.update(get_authority_changes(nodes, delta))
+    except ValueError as e:
+        logger.error(e)
+        scheduler.sync({node_id: node_data['reputation'] for node_id, node_data in nodes.items() if node_data['is_authority']})
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='This simulates the Proof of Concept for the blockchain with Proof of Verified Authority Consensus')
 
-    parser.add_argument('--method', type=str, choices=['add', 'remove', 'viewnode', 'broadcast'], help='This argument facilitates choosing the action on a node')
+    parser.add_argument('--method', type=str, choices=['add', 'remove', 'viewnode', 'broadcast', 'diff'], help='This argument facilitates choosing the action on a node')
     parser.add_argument('--certificate', type=str, help='The argument enables you to specify the path to the device certificate file')
     parser.add_argument('--fullnode', action='store_true', help='This is a flag to indicate if the device is a full node')
     parser.add_argument('--deviceid', type=str, help='This argument specifies the device ID')
     parser.add_argument('--node', type=int, help='This argument specifies the node index for the viewnode method')
+    parser.add_argument('--at-height', type=int, help='This argument specifies the block height to view the node at, or to diff from')
+    parser.add_argument('--to-height', type=int, help='This argument specifies the block height to diff to (default: latest)')
+    parser.add_argument('--sequence', type=int, help='This argument specifies the number of changes at --at-height to apply (default: all)')
+    parser.add_argument('--to-sequence', type=int, help='This argument specifies the number of changes at --to-height to apply (default: all)')
+    parser.add_argument('--scheduler_state', type=str, help='This argument takes in the path to store the state of the primary scheduler', default="scheduler.json")
+    parser.add_argument('--history', type=str, help='This argument takes in the path to store the history of the node states', default="history.json")
     parser.add_argument('--state', type=str, help='This argument specifies the path to payload file containing the state')
     parser.add_argument('--start', action='store_true', help='This flag indicates to start a new a new blockchain')
     parser.add_argument('--cpath', type=str, help='This argument takes in the path to store the chain persistently', default="chain.json")
     parser.add_argument('--src_nodes', type=str, help='This argument takes in the path that contains the pre-added nodes', default="nodes_init.json")
     parser.add_argument('--dest_nodes', type=str, help='This argument takes in the path to store the newly added or updated nodes', default="nodes.json")
+    parser.add_argument('--verifier', type=str, choices=['http', 'local'], help='This argument selects the certificate verification backend', default='http')
+    parser.add_argument('--ca_bundle', type=str, help='This argument takes in the path to the CA chain used by the local verifier')
     parser.add_argument('--max_noise', type=float, help='This argument takes the maximum permissable network noise for broadcast [value between 0-1]', default=-1)
     # parse arguments
     args = parser.parse_args()
     # access values of arguments
     method = args.method
+
+    if args.verifier == 'local':
+        if args.ca_bundle is None:
+            logger.error("The CA bundle is required for the local verifier")
+            exit(1)
+        verifier = LocalVerifier(args.ca_bundle)
     
     with open(args.src_nodes, 'r') as f:
         nodes_json = json.load(f)
@@ -574,6 +672,11 @@ if __name__ == '__main__':
 
     authority_nodes = get_authority_indices(nodes)
 
+    scheduler = PrimaryScheduler(args.scheduler_state, PRIMARY_COOLDOWN)
+    history = ReputationHistory(args.history)
+    if method in ('add', 'broadcast') and history.is_empty():
+        history.reset(nodes, get_chain_height(args.cpath))
+
     if method == 'add':
 
         certificate_path = args.certificate        
@@ -592,10 +695,7 @@ if __name__ == '__main__':
         node = Node()
         logger.debug(f"Authority node device IDs {get_authority_indices(nodes)}")
         
-        # print(authority_nodes)
-        primary_index = get_primary() % len(authority_nodes)
-        # print(primary_index)
-        set_primary(primary_index + 1)
+        primary_index = get_primary(scheduler, nodes, authority_nodes)
         authority_result = authority_verify(primary_index, cert_data)
         
         try:
@@ -606,7 +706,27 @@ if __name__ == '__main__':
     
     elif method == 'viewnode':
         node_num = args.node
-        logger.info(json.dumps(nodes[node_num], indent=4))
+        if args.at_height is None:
+            logger.info(json.dumps(nodes[node_num], indent=4))
+        else:
+            try:
+                nodes_at_height = history.at_height(args.at_height, args.sequence)
+                if node_num in nodes_at_height:
+                    logger.info(json.dumps(nodes_at_height[node_num], indent=4))
+                else:
+                    logger.warning(f"Node {node_num} was not in the network at block height {args.at_height}")
+            except ValueError as e:
+                logger.error(e)
+
+    elif method == 'diff':
+        try:
+            from_height = history.base_height if args.at_height is None else args.at_height
+            to_height = history.latest_height() if args.to_height is None else args.to_height
+            changes = history.diff(from_height, to_height, args.sequence, args.to_sequence)
+            logger.info(f"Changes in node states from block height {from_height} to {to_height}")
+            logger.info(json.dumps(changes, indent=4))
+        except ValueError as e:
+            logger.error(e)
 
     elif method == 'broadcast':
         state_path = args.state
@@ -618,34 +738,21 @@ if __name__ == '__main__':
                 state = state_file.read()
             if (args.start == True):
                 open(args.cpath, "w").close()
+                # A new blockchain starts from the genesis block, so the history starts over as well
+                history.reset(nodes, 0)
 
             blockchain = Blockchain(args.cpath)
-            primary_index = get_primary() % len(authority_nodes)
-            logger.debug(f"Authority Node {primary_index} has been chosen")
-
-            set_primary(primary_index + 1)
-            logger.debug(f"Indices of authority nodes are {authority_nodes}")
-            auth_votes_map, auth_vote, auth_vote_percent = broadcast_authority(authority_nodes, primary_index, args.max_noise)
-            follower_votes_map, follower_vote, follower_vote_percent = broadcast_followers(nodes, primary_index, authority_nodes, args.max_noise)
-
-            broadcast_reward(nodes, auth_votes_map, follower_votes_map, auth_vote, authority_nodes, primary_index)
-            consensus_message = {False: "reject", True:"accept"}
-            logger.info(f"{round(auth_vote_percent, 2)}% are in consensus to {consensus_message[auth_vote]} the state change.")
-
-            # print(auth_vote_percent)
-            if(auth_vote_percent > 50 and auth_vote == True):
-                logger.info("The transaction has been added")
-                
-                blockchain.add_block(json.loads(state))
+            if broadcast_state(nodes, authority_nodes, blockchain, json.loads(state), args.max_noise):
                 chain = blockchain.display_chain()
                 for block in chain:
                     print(json.dumps(block, indent=4))
-            else:
-                logger.warning("The transaction has not been added as it was not in majority consensus")
 
         except Exception as e:
             logger.error(e)
         
     with open(args.dest_nodes, 'w') as f:
         json.dump(nodes, f)
+
+    if method in ('add', 'broadcast'):
+        record_changes(history, nodes, args.cpath)
     # logger.debug(json.dumps(nodes, indent=4))
\ No newline at end of file
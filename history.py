@@ -0,0 +1,171 @@
+import json
+import os
+from bisect import bisect_left, bisect_right
+
+class ReputationHistory:
+    def __init__(self, history_file='history.json'):
+        """
+        Initializes the delta-encoded history of the node states keyed by block height.
+        The file stores the state at the base height, the latest state and, for every change of the nodes,
+        the block height and only the fields that changed. Its size grows with the number of changes, not
+        with the number of nodes times the number of blocks.
+
+        Args:
+            history_file (str): The path to the file storing the history (default: 'history.json').
+        """
+        self.history_file = history_file
+        try:
+            with open(self.history_file, 'r') as f:
+                history = json.load(f)
+            self.base_height = history['base_height']
+            self.base = history['base']
+            self.head = history['head']
+            self.heights = [height for height, _ in history['deltas']]
+            self.deltas = [delta for _, delta in history['deltas']]
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.base_height = None
+            self.base = {}
+            self.head = {}
+            self.heights = []
+            self.deltas = []
+
+    def is_empty(self):
+        """
+        Returns:
+            bool: True if no state has been recorded yet
+        """
+        return self.base_height is None
+
+    def reset(self, nodes, height=0):
+        """
+        Discards the history and starts a new one from the given state.
+
+        Args:
+            nodes (dict): A dictionary containing the data of all nodes added to the network
+            height (int): The block height of the state
+        """
+        self.base_height = height
+        self.base = _normalize(nodes)
+        self.head = _normalize(nodes)
+        self.heights = []
+        self.deltas = []
+
+    def record(self, height, nodes):
+        """
+        Records the changes of the node states at the given block height. Several changes can be
+        recorded at the same height, e.g. registrations or rejected broadcasts, and each one is kept
+        so that the intermediate states can be queried by their sequence at that height.
+
+        Args:
+            height (int): The current block height
+            nodes (dict): A dictionary containing the data of all nodes added to the network
+
+        Returns:
+            dict: The recorded changes, mapping the node index to the changed fields or None if removed
+        """
+        last_height = self.heights[-1] if self.heights else self.base_height
+        if height < last_height:
+            raise ValueError(f"Cannot record block height {height} after block height {last_height}")
+
+        nodes = _normalize(nodes)
+        delta = _delta(self.head, nodes)
+        if not delta:
+            return delta
+        self.heights.append(height)
+        self.deltas.append(delta)
+        self.head = nodes
+        return delta
+
+    def at_height(self, height, sequence=None):
+        """
+        Reconstructs the node states at the given block height.
+
+        Args:
+            height (int): The block height
+            sequence (int): The number of changes recorded at that height to apply (default: all of them)
+
+        Returns:
+            dict: A dictionary containing the data of all nodes at that height
+        """
+        if self.is_empty() or height < self.base_height:
+            raise ValueError(f"No node states recorded at block height {height}")
+        end = bisect_right(self.heights, height)
+        if sequence is not None:
+            start = bisect_left(self.heights, height)
+            if not 0 <= sequence <= end - start:
+                raise ValueError(f"There are {end - start} changes recorded at block height {height}")
+            end = start + sequence
+        state = {node_id: dict(node_data) for node_id, node_data in self.base.items()}
+        for delta in self.deltas[:end]:
+            _apply(state, delta)
+        return {int(node_id): node_data for node_id, node_data in state.items()}
+
+    def diff(self, from_height, to_height, from_sequence=None, to_sequence=None):
+        """
+        Returns the changes of the node states between two block heights.
+
+        Args:
+            from_height (int): The block height to compare from
+            to_height (int): The block height to compare to
+            from_sequence (int): The number of changes at the from height to apply (default: all of them)
+            to_sequence (int): The number of changes at the to height to apply (default: all of them)
+
+        Returns:
+            dict: A dictionary mapping the node index to the changed fields and their [old, new] values
+        """
+        before = self.at_height(from_height, from_sequence)
+        after = self.at_height(to_height, to_sequence)
+        changes = {}
+        for node_id in sorted(before.keys() | after.keys()):
+            old = before.get(node_id, {})
+            new = after.get(node_id, {})
+            fields = {field: [old.get(field), new.get(field)] for field in sorted(old.keys() | new.keys())
+                      if old.get(field) != new.get(field)}
+            if fields:
+                changes[node_id] = fields
+        return changes
+
+    def latest_height(self):
+        """
+        Returns:
+            int: The highest block height recorded
+        """
+        return self.heights[-1] if self.heights else self.base_height
+
+    def save(self):
+        """
+        Writes the history to its file, replacing the previous file atomically.
+        """
+        history = {
+            "base_height": self.base_height,
+            "base": self.base,
+            "head": self.head,
+            "deltas": [[height, delta] for height, delta in zip(self.heights, self.deltas)]
+        }
+        tmp_file = self.history_file + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump(history, f)
+        os.replace(tmp_file, self.history_file)
+
+def _normalize(nodes):
+    # JSON object keys are strings while the nodes dictionary is keyed by int
+    return {str(node_id): dict(node_data) for node_id, node_data in nodes.items()}
+
+def _delta(old, new):
+    delta = {node_id: None for node_id in old.keys() - new.keys()}
+    for node_id, node_data in new.items():
+        previous = old.get(node_id)
+        if previous is None:
+            delta[node_id] = dict(node_data)
+            continue
+        fields = {field: value for field, value in node_data.items() if previous.get(field) != value}
+        if fields:
+            delta[node_id] = fields
+    return delta
+
+def _apply(state, delta):
+    for node_id, fields in delta.items():
+        if fields is None:
+            state.pop(node_id, None)
+        else:
+            state.setdefault(node_id, {}).update(fields)
@@ -0,0 +1,258 @@
+import fcntl
+import heapq
+import json
+import os
+import tempfile
+import threading
+import uuid
+from contextlib import contextmanager
+
+STRIDE = 1 << 20        # The pass advance of a node with a weight of 1
+MIN_JOURNAL = 1024      # The number of journal records after which the state file may be compacted
+HEADER_SIZE = len(b'{"generation": "' + b'0' * 32 + b'"}\n')     # The fixed size of the header line naming the file generation
+
+class PrimaryScheduler:
+    def __init__(self, state_file='scheduler.json', cooldown=2):
+        """
+        Initializes a scheduler that picks the primary authority node by weighted round robin over the
+        reputation of the authority nodes (stride scheduling). Every node advances its pass by STRIDE / weight
+        when picked and the node with the lowest pass is picked next, so a pick costs O(log n).
+        The state is kept in memory. Every change is appended as a record to the state file, which is compacted
+        into a single snapshot by an atomic replace once there are more than MIN_JOURNAL records and more than
+        twice as many records as nodes. Before every call the records appended by other processes since the
+        last call are replayed, under a lock on the file.
+
+        Args:
+            state_file (str): The path to the file storing the scheduler state (default: 'scheduler.json').
+            cooldown (int): The number of picks a node is skipped for after it failed to vote
+        """
+        self.state_file = state_file
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._generation = None
+        self._offset = 0
+        self._journal = 0
+        self._reset_state()
+
+    def next_primary(self):
+        """
+        Picks the next primary authority node, skipping the nodes that recently failed to vote
+        unless all of them did.
+
+        Returns:
+            int or None: The index of the primary authority node with respect to the nodes dictionary, None if there are no authority nodes
+        """
+        with self._locked():
+            node_id = self._choose()
+            if node_id is not None:
+                node_pass = self.passes[node_id] + STRIDE / self.weights[node_id]
+                self._append({"op": "pick", "node": node_id, "pass": node_pass})
+        return node_id
+
+    def mark_failed(self, node_ids):
+        """
+        Marks the nodes that failed to vote so that they are skipped for the next picks.
+
+        Args:
+            node_ids (list): The indices of the nodes that failed to vote
+        """
+        with self._locked():
+            node_ids = [node_id for node_id in node_ids if node_id in self.weights]
+            if node_ids and self.cooldown > 0:
+                self._append({"op": "fail", "nodes": node_ids, "until": self.round + self.cooldown})
+
+    def update(self, authorities):
+        """
+        Applies the changes of the authority nodes, costing O(log n) per changed node.
+
+        Args:
+            authorities (dict): A dictionary mapping the index of every changed node to its reputation, or None if it is no longer an authority node
+        """
+        with self._locked():
+            weights = [[node_id, None if reputation is None else max(1, reputation)]
+                       for node_id, reputation in authorities.items()
+                       if reputation is not None or node_id in self.weights]
+            if weights:
+                self._append({"op": "update", "weights": weights})
+
+    def sync(self, authorities):
+        """
+        Replaces all the authority nodes, costing O(n). The nodes that are kept retain their pass.
+
+        Args:
+            authorities (dict): A dictionary mapping the index of every authority node to its reputation
+        """
+        with self._locked():
+            weights = [[node_id, None] for node_id in self.weights if node_id not in authorities]
+            weights += [[node_id, max(1, reputation)] for node_id, reputation in authorities.items()]
+            if weights:
+                self._append({"op": "update", "weights": weights})
+
+    def _reset_state(self):
+        self.round = 0
+        self.vtime = 0          # The pass of the last picked node, at which new nodes join
+        self.passes = {}
+        self.weights = {}
+        self.failed_until = {}
+        self._heap = []         # (pass, version, node_id), entries with an outdated version are dropped lazily
+        self._versions = {}
+        self._version = 0
+        self._cooldowns = []    # (round, node_id) at which the cooldown of a node expires
+
+    def _push(self, node_id):
+        self._version += 1
+        self._versions[node_id] = self._version
+        heapq.heappush(self._heap, (self.passes[node_id], self._version, node_id))
+
+    def _choose(self):
+        while self._heap:
+            _, version, node_id = self._heap[0]
+            if self._versions.get(node_id) == version and node_id not in self.failed_until:
+                return node_id
+            # Outdated or cooling down, the node is pushed again when its cooldown expires
+            heapq.heappop(self._heap)
+        if self.failed_until:
+            # Every authority node has recently failed to vote, fall back to the one with the lowest pass
+            return min(self.failed_until, key=lambda node_id: (self.passes[node_id], node_id))
+        return None
+
+    def _apply(self, record):
+        op = record["op"]
+        if op == "pick":
+            node_id = record["node"]
+            if node_id in self.weights:
+                self.vtime = self.passes[node_id]
+                self.passes[node_id] = record["pass"]
+                self._push(node_id)
+            self.round += 1
+            while self._cooldowns and self._cooldowns[0][0] <= self.round:
+                until, node_id = heapq.heappop(self._cooldowns)
+                if self.failed_until.get(node_id) == until:
+                    del self.failed_until[node_id]
+                    self._push(node_id)
+        elif op == "fail":
+            for node_id in record["nodes"]:
+                if node_id in self.weights:
+                    self.failed_until[node_id] = record["until"]
+                    heapq.heappush(self._cooldowns, (record["until"], node_id))
+        elif op == "update":
+            for node_id, weight in record["weights"]:
+                if weight is None:
+                    self.weights.pop(node_id, None)
+                    self.passes.pop(node_id, None)
+                    self.failed_until.pop(node_id, None)
+                    self._versions.pop(node_id, None)
+                elif node_id in self.weights:
+                    self.weights[node_id] = weight
+                else:
+                    # New nodes join at the current pass so they do not monopolize the following picks
+                    self.weights[node_id] = weight
+                    self.passes[node_id] = self.vtime
+                    self._push(node_id)
+        elif op == "snapshot":
+            self._reset_state()
+            self.round = record["round"]
+            self.vtime = record["vtime"]
+            self.weights = {node_id: weight for node_id, weight in record["weights"]}
+            self.passes = {node_id: node_pass for node_id, node_pass in record["passes"]}
+            self.failed_until = {node_id: until for node_id, until in record["failed_until"]}
+            self._rebuild()
+
+    def _rebuild(self):
+        self._versions = {node_id: version for version, node_id in enumerate(self.passes)}
+        self._version = len(self._versions)
+        self._heap = [(self.passes[node_id], version, node_id) for node_id, version in self._versions.items()]
+        heapq.heapify(self._heap)
+        self._cooldowns = [(until, node_id) for node_id, until in self.failed_until.items()]
+        heapq.heapify(self._cooldowns)
+
+    @contextmanager
+    def _locked(self):
+        # Serializes the threads of this process and the schedulers of concurrent processes sharing the state file
+        with self._lock, open(self.state_file + '.lock', 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                self._load()
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _load(self):
+        try:
+            f = open(self.state_file, 'rb')
+        except FileNotFoundError:
+            if self._generation is not None:
+                self._reset_state()
+                self._generation, self._offset, self._journal = None, 0, 0
+            return
+        with f:
+            generation = _parse_header(f.read(HEADER_SIZE))
+            size = os.fstat(f.fileno()).st_size
+            if generation is None:
+                # An empty file or the header of an interrupted process, it is rewritten by the next append
+                if self._generation is not None:
+                    self._reset_state()
+                self._generation, self._offset, self._journal = None, 0, 0
+                return
+            if generation != self._generation or size < self._offset:
+                # The file has been compacted or replaced by another process
+                self._reset_state()
+                self._generation, self._offset, self._journal = generation, HEADER_SIZE, 0
+            if size == self._offset:
+                return
+            f.seek(self._offset)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    # The record of an interrupted process, it is truncated by the next append
+                    break
+                self._apply(json.loads(line))
+                self._offset += len(line)
+                self._journal += 1
+
+    def _append(self, record):
+        self._apply(record)
+        data = json.dumps(record).encode() + b'\n'
+        with open(self.state_file, 'ab') as f:
+            f.truncate(self._offset)
+            if self._offset == 0:
+                self._generation = uuid.uuid4().hex
+                data = _header(self._generation) + data
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        self._offset += len(data)
+        self._journal += 1
+        if self._journal > max(MIN_JOURNAL, 2 * len(self.passes)):
+            self._compact()
+
+    def _compact(self):
+        snapshot = {
+            "op": "snapshot",
+            "round": self.round,
+            "vtime": self.vtime,
+            "weights": [[node_id, weight] for node_id, weight in self.weights.items()],
+            "passes": [[node_id, node_pass] for node_id, node_pass in self.passes.items()],
+            "failed_until": [[node_id, until] for node_id, until in self.failed_until.items()]
+        }
+        # A new generation tells the other processes to replay the file from the start
+        generation = uuid.uuid4().hex
+        data = _header(generation) + json.dumps(snapshot).encode() + b'\n'
+        directory = os.path.dirname(os.path.abspath(self.state_file))
+        with tempfile.NamedTemporaryFile('wb', dir=directory, delete=False) as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(f.name, self.state_file)
+        self._generation, self._offset, self._journal = generation, len(data), 1
+        self._rebuild()
+
+def _header(generation):
+    return json.dumps({"generation": generation}).encode() + b'\n'
+
+def _parse_header(header):
+    if len(header) != HEADER_SIZE or not header.endswith(b'\n'):
+        return None
+    try:
+        return json.loads(header)["generation"]
+    except (ValueError, KeyError):
+        return None
@@ -0,0 +1,97 @@
+from abc import ABC, abstractmethod
+
+import requests
+from requests.adapters import HTTPAdapter
+from OpenSSL import crypto
+
+from app import load_trust_store, verify_certificate_chain, verify_certificate_store
+
+class Verifier(ABC):
+    """
+    The interface of a backend that nodes use to retrieve the CA chain and verify device certificates.
+    """
+    @abstractmethod
+    def get_ca_chain(self):
+        """
+        Returns:
+            str or None: The PEM-encoded CA chain of trust, None if it could not be retrieved
+        """
+
+    @abstractmethod
+    def verify(self, cert_data, trusted_data):
+        """
+        Args:
+            cert_data (str): The PEM-encoded certificate
+            trusted_data (str): The PEM-encoded CA chain of trust
+
+        Returns:
+            bool or None: True if the certificate is valid, False if invalid and None if the verification failed
+        """
+
+class HttpVerifier(Verifier):
+    def __init__(self, ca_chain_url, verify_url, pool_size=10, timeout=5):
+        """
+        Initializes a backend that calls the Vault PKI endpoint and the verification server of 'app.py'.
+        The connections are kept alive and reused across votes.
+
+        Args:
+            ca_chain_url (str): The URL that serves the CA chain
+            verify_url (str): The URL of the '/verify-certificate' endpoint
+            pool_size (int): The maximum number of connections kept alive per host
+            timeout (float): The number of seconds to wait for a service before the vote fails
+        """
+        self.ca_chain_url = ca_chain_url
+        self.verify_url = verify_url
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def get_ca_chain(self):
+        try:
+            chain_response = self.session.get(self.ca_chain_url, timeout=self.timeout)
+        except requests.RequestException:
+            return None
+        if chain_response.status_code != 200:
+            return None
+        return chain_response.text
+
+    def verify(self, cert_data, trusted_data):
+        if trusted_data is None:
+            return None
+        try:
+            verify_response = self.session.post(self.verify_url, data={"certificate": cert_data, "trusted": trusted_data}, timeout=self.timeout)
+        except requests.RequestException:
+            return None
+        if verify_response.status_code != 200:
+            return None
+        return verify_response.text == "True"
+
+class LocalVerifier(Verifier):
+    def __init__(self, ca_bundle):
+        """
+        Initializes an in-process backend that verifies certificates against a CA bundle loaded from disk.
+        The certificate store is built once and reused for every vote.
+
+        Args:
+            ca_bundle (str): The path to the PEM-encoded CA chain
+        """
+        with open(ca_bundle, 'r') as f:
+            self.ca_chain = f.read()
+        self.store = load_trust_store(self.ca_chain)
+
+    def get_ca_chain(self):
+        return self.ca_chain
+
+    def verify(self, cert_data, trusted_data):
+        if trusted_data is None:
+            return None
+        try:
+            if trusted_data != self.ca_chain:
+                return verify_certificate_chain(cert_data, trusted_data)
+            certificate = crypto.load_certificate(crypto.FILETYPE_PEM, cert_data)
+        except crypto.Error:
+            # The certificate could not be parsed, which the verification server answers with an error
+            return None
+        return verify_certificate_store(certificate, self.store)